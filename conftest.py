@@ -0,0 +1 @@
+"""Lets pytest import the emulator modules from the repository root"""
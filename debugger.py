@@ -0,0 +1,552 @@
+"""Debugger for the RV32 Single Cycle Emulator.
+
+Headless Debugger API with PC breakpoints (optionally conditional on register
+values), memory watchpoints, step/next/continue and reverse-step, an
+interactive shell on top of it and a minimal GDB remote serial protocol stub.
+
+Between stops the program runs on the fast engine, breakpoints are only
+checked on basic block boundaries.
+
+Usage: python debugger.py PROGRAM [--gdb PORT]
+"""
+
+import argparse
+import ast
+import cmd
+import logging
+import socket
+import sys
+from collections import deque
+from dataclasses import dataclass
+from single_cycle_cpu import RiscV
+from rv_units.register_file import DataRegister
+
+
+@dataclass
+class Stop:
+    """Why the debugger handed control back"""
+    reason: str # 'step', 'breakpoint', 'watchpoint', 'halted' or 'limit'
+    pc: int
+    detail: str = ''
+    watchpoint: 'Watchpoint | None' = None # Set on watchpoint stops
+    address: int | None = None # Address accessed on watchpoint stops
+
+    def __str__(self):
+        text = f'{self.reason} at {hex(self.pc)}'
+        return f'{text} ({self.detail})' if self.detail else text
+
+
+@dataclass
+class Watchpoint:
+    """Memory range watched for reads ('r'), writes ('w') or both ('rw')"""
+    address: int
+    length: int = 4
+    kind: str = 'w'
+
+    def hit(self, kind: str, address: int) -> bool:
+        """True if a 4 byte access of kind at address touches the watched range"""
+        return (kind in self.kind
+                and address < self.address + self.length
+                and self.address < address + 4)
+
+
+@dataclass
+class _Checkpoint:
+    """Architectural state to replay from when reverse stepping
+
+    Memory isn't copied: undo maps the address of every word written since
+    this checkpoint was taken to the bytes it held before the first write.
+    """
+    position: int
+    pc: int
+    registers: list
+    undo: dict
+
+
+_REGISTER_NAMES: dict = {f'x{i}': i for i in range(32)}
+
+
+class _RegisterNames(ast.NodeTransformer):
+    """Rewrite xN to registers[N] so conditions index the engine's register list"""
+    def visit_Name(self, node): # pylint: disable=invalid-name
+        """Replace register names, anything else but pc is rejected"""
+        if node.id in _REGISTER_NAMES:
+            return ast.copy_location(ast.Subscript(
+                value=ast.Name('registers', ast.Load()),
+                slice=ast.Constant(_REGISTER_NAMES[node.id]),
+                ctx=ast.Load()), node)
+        if node.id != 'pc':
+            raise ValueError(f'Unknown name in condition: {node.id}')
+        return node
+
+
+def compile_condition(expression: str):
+    """Compile an expression over the registers x0..x31 and pc, like 'x5 == 3 and x6 < 0'
+
+    Returns a condition(registers, pc) function the engine calls on its
+    plain list of register values.
+    """
+    try:
+        body = ast.parse(expression, '<condition>', 'eval').body
+    except SyntaxError as e:
+        raise ValueError(f'Invalid condition {expression!r}: {e.msg}') from e
+    function = ast.Expression(ast.Lambda(
+        args=ast.arguments(posonlyargs=[], args=[ast.arg('registers'), ast.arg('pc')],
+                           kwonlyargs=[], kw_defaults=[], defaults=[]),
+        body=_RegisterNames().visit(body)))
+    ast.fix_missing_locations(function)
+    return eval(compile(function, '<condition>', 'eval'), {'__builtins__': {}}) # pylint: disable=eval-used
+
+
+class Debugger:
+    """Headless debugger around a RiscV emulator"""
+    def __init__(self, risc_v: RiscV, history: int = 64):
+        self._risc_v: RiscV = risc_v
+        self._breakpoints: dict = {} # Address -> condition, or None if unconditional
+        self._watchpoints: list = []
+        self._watch_hit: tuple | None = None # (watchpoint, kind, address) of the last hit
+        self._position: int = 0 # Instructions executed under the debugger
+        self._history: deque = deque(maxlen=history)
+
+    @property
+    def pc(self) -> int:
+        """Current value of the program counter"""
+        return self._risc_v.pc_value()
+
+    @property
+    def position(self) -> int:
+        """Number of instructions executed under the debugger"""
+        return self._position
+
+    @property
+    def breakpoints(self) -> dict:
+        """Breakpoint addresses and their conditions"""
+        return dict(self._breakpoints)
+
+    @property
+    def watchpoints(self) -> list:
+        """Active watchpoints"""
+        return list(self._watchpoints)
+
+    def instruction_at(self, address: int) -> str | None:
+        """Instruction loaded at address, None if there is none"""
+        return self._risc_v.instruction_at_address(address)
+
+    def registers(self) -> list:
+        """Values of x0..x31"""
+        return [int(self._risc_v.registers.get_reg(i)) for i in range(32)]
+
+    def set_register(self, register: int, value: int) -> None:
+        """Write a register, x0 stays hardwired to zero"""
+        if register == 0:
+            raise ValueError('Cannot write to x0')
+        if not 1 <= register <= 31:
+            raise ValueError(f'Invalid register x{register}')
+        self._risc_v.registers.get_reg(register).write_int(value)
+
+    def set_pc(self, value: int) -> None:
+        """Move the program counter"""
+        self._risc_v.pc = DataRegister(value)
+
+    def read_memory(self, address: int, length: int) -> bytes:
+        """Read length bytes of data memory"""
+        return self._risc_v.data_memory.extract(address, length)
+
+    def write_memory(self, address: int, data: bytes) -> None:
+        """Write bytes to data memory"""
+        data_mem = self._risc_v.data_memory
+        if self._history and data:
+            # Journaled by word like the engine's stores, so both share the undo log
+            undo = self._history[-1].undo
+            for word in range(address & ~3, address + len(data), 4):
+                if word not in undo and 0 <= word < data_mem.size:
+                    undo[word] = data_mem.extract(word, min(4, data_mem.size - word))
+        data_mem.load(address, data)
+
+    def add_breakpoint(self, address: int, condition=None) -> None:
+        """Stop before executing address, only if condition(registers, pc) is true when given"""
+        if address % 4:
+            raise ValueError(f'Breakpoint address {hex(address)} is not word aligned')
+        self._breakpoints[address] = condition
+
+    def remove_breakpoint(self, address: int) -> None:
+        """Delete the breakpoint at address"""
+        if self._breakpoints.pop(address, False) is False:
+            raise ValueError(f'No breakpoint at {hex(address)}')
+
+    def add_watchpoint(self, address: int, length: int = 4, kind: str = 'w') -> None:
+        """Stop after a load ('r'), store ('w') or either ('rw') touches [address, address + length)"""
+        if kind not in ('r', 'w', 'rw'):
+            raise ValueError(f'Invalid watchpoint kind: {kind}')
+        self._watchpoints.append(Watchpoint(address, length, kind))
+
+    def remove_watchpoint(self, address: int) -> None:
+        """Delete the watchpoints starting at address"""
+        remaining = [w for w in self._watchpoints if w.address != address]
+        if len(remaining) == len(self._watchpoints):
+            raise ValueError(f'No watchpoint at {hex(address)}')
+        self._watchpoints = remaining
+
+    def _watch(self, kind: str, address: int) -> bool:
+        """Watch callback for the fast engine"""
+        for watchpoint in self._watchpoints:
+            if watchpoint.hit(kind, address):
+                self._watch_hit = (watchpoint, kind, address)
+                return True
+        return False
+
+    def _checkpoint(self) -> None:
+        """Save the current state to the reverse execution history"""
+        if self._history and self._history[-1].position == self._position:
+            return
+        self._history.append(_Checkpoint(self._position, self.pc, self.registers(), {}))
+
+    def _run(self, max_cycles: int | None, breakpoints: frozenset, watch: bool,
+             conditions: dict | None = None) -> bool:
+        """Run the engine and keep track of the position"""
+        before = self._risc_v.retired
+        self._watch_hit = None
+        try:
+            return self._risc_v.run(max_cycles, breakpoints,
+                                    self._watch if watch and self._watchpoints else None,
+                                    conditions,
+                                    self._history[-1].undo if self._history else None)
+        finally:
+            self._position += self._risc_v.retired - before
+
+    def _resume(self, max_cycles: int | None, extra: frozenset = frozenset()) -> Stop:
+        """Run until a breakpoint whose condition holds, a watchpoint, a halt or max_cycles"""
+        self._checkpoint()
+        breakpoints = frozenset(self._breakpoints) | extra
+        # Conditions are evaluated by the engine, a false one never stops it
+        conditions = {address: condition for address, condition in self._breakpoints.items()
+                      if condition is not None and address not in extra}
+        if not self._run(max_cycles, breakpoints, True, conditions):
+            return Stop('halted', self.pc)
+        if self._watch_hit is not None:
+            watchpoint, kind, address = self._watch_hit
+            action = 'read' if kind == 'r' else 'write'
+            return Stop('watchpoint', self.pc, f'{action} of {hex(address)}', watchpoint, address)
+        if self.pc in extra:
+            return Stop('step', self.pc)
+        if self.pc in self._breakpoints:
+            condition = self._breakpoints[self.pc]
+            if condition is None or condition(self.registers(), self.pc):
+                return Stop('breakpoint', self.pc)
+        return Stop('limit', self.pc)
+
+    def step(self, count: int = 1) -> Stop:
+        """Execute count instructions, stopping early on watchpoints"""
+        stop = self._resume(count)
+        return Stop('step', stop.pc) if stop.reason in ('limit', 'breakpoint') else stop
+
+    def next(self) -> Stop:
+        """Step, running a backward branch until it falls through (steps over loops)"""
+        instruction = self.instruction_at(self.pc)
+        if instruction is None:
+            return Stop('halted', self.pc)
+        # Only branches with a negative offset (sign bit set) close a loop
+        if instruction[25:32] != '1100011' or instruction[0] == '0':
+            return self.step()
+        return self._resume(None, frozenset((self.pc + 4,)))
+
+    def cont(self, max_cycles: int | None = None) -> Stop:
+        """Continue until a breakpoint, a watchpoint, a halt or max_cycles instructions"""
+        return self._resume(max_cycles)
+
+    def reverse_step(self, count: int = 1) -> Stop:
+        """Go back count instructions by replaying from the newest earlier checkpoint"""
+        target = self._position - count
+        if target < 0:
+            raise ValueError('Cannot step back before the start of the program')
+        if not self._history or self._history[0].position > target:
+            raise ValueError('Not enough history to step back')
+        # Roll memory back through the undo logs, newest first
+        data_mem = self._risc_v.data_memory
+        while True:
+            checkpoint = self._history[-1]
+            for address, old in reversed(checkpoint.undo.items()):
+                data_mem.load(address, old)
+            checkpoint.undo.clear()
+            if checkpoint.position <= target:
+                break
+            self._history.pop()
+        for i in range(1, 32):
+            self._risc_v.registers.get_reg(i).write_int(checkpoint.registers[i])
+        self.set_pc(checkpoint.pc)
+        self._position = checkpoint.position
+        self._run(target - self._position, frozenset(), False)
+        return Stop('step', self.pc)
+
+
+class DebuggerShell(cmd.Cmd):
+    """Interactive shell for the Debugger"""
+    intro = 'RV32 debugger, type help or ? to list commands.'
+    prompt = '(rvdb) '
+
+    def __init__(self, debugger: Debugger):
+        super().__init__()
+        self._debugger: Debugger = debugger
+
+    def onecmd(self, line):
+        try:
+            return super().onecmd(line)
+        except Exception as e: # pylint: disable=broad-except
+            print(f'Error: {e}')
+            return False
+
+    def _show(self, stop: Stop) -> None:
+        """Print a stop and the instruction at the PC"""
+        instruction = self._debugger.instruction_at(stop.pc)
+        print(stop)
+        if instruction is not None:
+            print(f'  {hex(stop.pc)}: {instruction}')
+
+    def do_break(self, arg):
+        """break ADDRESS [if CONDITION] -- stop before ADDRESS, e.g. break 0x10 if x5 == 3"""
+        address, _, condition = arg.partition(' if ')
+        self._debugger.add_breakpoint(int(address, 0),
+                                      compile_condition(condition) if condition else None)
+
+    def do_delete(self, arg):
+        """delete ADDRESS -- remove the breakpoint at ADDRESS"""
+        self._debugger.remove_breakpoint(int(arg, 0))
+
+    def do_watch(self, arg):
+        """watch ADDRESS [LENGTH] [r|w|rw] -- stop after memory accesses, writes by default"""
+        args = arg.split()
+        if not 1 <= len(args) <= 3:
+            raise ValueError('Usage: watch ADDRESS [LENGTH] [r|w|rw]')
+        self._debugger.add_watchpoint(int(args[0], 0),
+                                      int(args[1], 0) if len(args) > 1 else 4,
+                                      args[2] if len(args) > 2 else 'w')
+
+    def do_unwatch(self, arg):
+        """unwatch ADDRESS -- remove the watchpoints at ADDRESS"""
+        self._debugger.remove_watchpoint(int(arg, 0))
+
+    def do_info(self, _arg):
+        """info -- list breakpoints and watchpoints"""
+        for address, condition in self._debugger.breakpoints.items():
+            print(f'break {hex(address)}{" (conditional)" if condition else ""}')
+        for watchpoint in self._debugger.watchpoints:
+            print(f'watch {hex(watchpoint.address)} {watchpoint.length} {watchpoint.kind}')
+
+    def do_step(self, arg):
+        """step [COUNT] -- execute COUNT instructions"""
+        self._show(self._debugger.step(int(arg, 0) if arg else 1))
+
+    def do_next(self, _arg):
+        """next -- step, running loops until they fall through"""
+        self._show(self._debugger.next())
+
+    def do_continue(self, _arg):
+        """continue -- run until a breakpoint, watchpoint or halt"""
+        self._show(self._debugger.cont())
+
+    def do_rstep(self, arg):
+        """rstep [COUNT] -- go back COUNT instructions"""
+        self._show(self._debugger.reverse_step(int(arg, 0) if arg else 1))
+
+    def do_regs(self, _arg):
+        """regs -- print the PC and registers"""
+        print(f'pc  = {hex(self._debugger.pc)}')
+        for i, value in enumerate(self._debugger.registers()):
+            print(f'x{i:<2} = {value}')
+
+    def do_set(self, arg):
+        """set xN|pc VALUE -- write a register or the PC"""
+        register, value = arg.split()
+        if register == 'pc':
+            self._debugger.set_pc(int(value, 0))
+        else:
+            self._debugger.set_register(int(register.lstrip('x')), int(value, 0))
+
+    def do_mem(self, arg):
+        """mem ADDRESS [LENGTH] -- print data memory as little endian words"""
+        args = arg.split()
+        if not 1 <= len(args) <= 2:
+            raise ValueError('Usage: mem ADDRESS [LENGTH]')
+        address = int(args[0], 0)
+        data = self._debugger.read_memory(address, int(args[1], 0) if len(args) > 1 else 16)
+        for offset in range(0, len(data), 4):
+            word = int.from_bytes(data[offset:offset + 4], 'little', signed=True)
+            print(f'{hex(address + offset)}: {data[offset:offset + 4].hex()} ({word})')
+
+    def do_quit(self, _arg):
+        """quit -- leave the debugger"""
+        return True
+
+    do_b = do_break
+    do_s = do_step
+    do_n = do_next
+    do_c = do_continue
+    do_rs = do_rstep
+    do_q = do_quit
+    do_EOF = do_quit
+
+
+class GdbStub:
+    """Minimal GDB remote serial protocol stub over a local TCP socket
+
+    Supports register and memory access, step, continue and breakpoints
+    and watchpoints (Z0, Z2-Z4). Connect with:
+        (gdb) set architecture riscv:rv32
+        (gdb) target remote localhost:PORT
+    """
+    def __init__(self, debugger: Debugger, port: int = 1234):
+        self._debugger: Debugger = debugger
+        self._port: int = port
+
+    @staticmethod
+    def _word(value: int) -> str:
+        """Register value as GDB expects it, little endian hex"""
+        return (value & 0xFFFFFFFF).to_bytes(4, 'little').hex()
+
+    def _stop_reply(self, stop: Stop) -> str:
+        """Reply packet for a stop, watchpoint stops tell GDB which access fired"""
+        if stop.reason == 'halted':
+            return 'W00'
+        if stop.reason == 'watchpoint':
+            name = {'w': 'watch', 'r': 'rwatch', 'rw': 'awatch'}[stop.watchpoint.kind] # type: ignore
+            return f'T05{name}:{stop.address:x};'
+        return 'S05'
+
+    def _handle(self, packet: str) -> str | None:
+        """Reply to one packet, None closes the connection"""
+        debugger = self._debugger
+        kind, body = packet[:1], packet[1:]
+        try:
+            match kind:
+                case '?':
+                    return 'S05'
+                case 'g':
+                    return ''.join(self._word(v) for v in debugger.registers() + [debugger.pc])
+                case 'G':
+                    if len(body) < 33 * 8:
+                        return 'E01'
+                    values = [int.from_bytes(bytes.fromhex(body[i:i + 8]), 'little', signed=True)
+                              for i in range(0, 33 * 8, 8)]
+                    for register in range(1, 32):
+                        debugger.set_register(register, values[register])
+                    debugger.set_pc(values[32])
+                    return 'OK'
+                case 'p':
+                    register = int(body, 16)
+                    values = debugger.registers() + [debugger.pc]
+                    return self._word(values[register]) if register < 33 else 'E01'
+                case 'P':
+                    register, value = body.split('=')
+                    register = int(register, 16)
+                    value = int.from_bytes(bytes.fromhex(value), 'little', signed=True)
+                    if register > 32:
+                        return 'E01'
+                    if register == 32:
+                        debugger.set_pc(value)
+                    elif register != 0:
+                        debugger.set_register(register, value)
+                    return 'OK'
+                case 'm':
+                    address, length = (int(x, 16) for x in body.split(','))
+                    return debugger.read_memory(address, length).hex()
+                case 'M':
+                    header, data = body.split(':')
+                    address = int(header.split(',')[0], 16)
+                    debugger.write_memory(address, bytes.fromhex(data))
+                    return 'OK'
+                case 's':
+                    return self._stop_reply(debugger.step())
+                case 'c':
+                    return self._stop_reply(debugger.cont())
+                case 'Z' | 'z':
+                    point, address, length = body.split(',')[:3]
+                    address, length = int(address, 16), int(length, 16)
+                    if point == '0':
+                        if kind == 'Z':
+                            debugger.add_breakpoint(address)
+                        else:
+                            debugger.remove_breakpoint(address)
+                    elif point in ('2', '3', '4'):
+                        if kind == 'Z':
+                            watch_kind = {'2': 'w', '3': 'r', '4': 'rw'}[point]
+                            debugger.add_watchpoint(address, length, watch_kind)
+                        else:
+                            debugger.remove_watchpoint(address)
+                    else:
+                        return ''
+                    return 'OK'
+                case 'q':
+                    if body.startswith('Supported'):
+                        return 'PacketSize=4000'
+                    if body == 'Attached':
+                        return '1'
+                    return ''
+                case 'H':
+                    return 'OK'
+                case 'D':
+                    return None
+                case 'k':
+                    return None
+                case _:
+                    return ''
+        except Exception: # pylint: disable=broad-except
+            # Keep the session alive, GDB reports the error to the user
+            return 'E01'
+
+    @staticmethod
+    def _packet(data: str) -> bytes:
+        """Frame a reply with its checksum"""
+        checksum = sum(data.encode()) % 256
+        return f'${data}#{checksum:02x}'.encode()
+
+    def serve(self) -> None:
+        """Wait for a single GDB connection on localhost and serve it until it detaches"""
+        with socket.create_server(('127.0.0.1', self._port)) as server:
+            logging.info('[GDB] Waiting for GDB on localhost:%s', self._port)
+            connection, _ = server.accept()
+            with connection:
+                buffer = b''
+                while True:
+                    received = connection.recv(4096)
+                    if not received:
+                        return
+                    buffer += received
+                    while b'#' in buffer and len(buffer) >= buffer.index(b'#') + 3:
+                        start = buffer.find(b'$')
+                        end = buffer.index(b'#')
+                        if start < 0 or start > end:
+                            buffer = buffer[end + 3:]
+                            continue
+                        packet = buffer[start + 1:end].decode()
+                        buffer = buffer[end + 3:]
+                        connection.sendall(b'+')
+                        reply = self._handle(packet)
+                        if reply is None:
+                            connection.sendall(self._packet('OK'))
+                            return
+                        connection.sendall(self._packet(reply))
+
+
+def _main() -> int:
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Debug a program on the emulator')
+    parser.add_argument('program', help='Program to load')
+    parser.add_argument('--gdb', type=int, metavar='PORT', help='Serve GDB on localhost:PORT')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    with RiscV() as risc_v:
+        try:
+            risc_v.load_program(args.program)
+        except (ValueError, OSError) as e:
+            print(f'Failed to load program: {e}')
+            return 1
+        debugger = Debugger(risc_v)
+        if args.gdb is not None:
+            GdbStub(debugger, args.gdb).serve()
+        else:
+            DebuggerShell(debugger).cmdloop()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -0,0 +1,366 @@
+"""Random program fuzzer for the RV32 Single Cycle Emulator.
+
+Generates random programs over the supported instructions (add, sub, and,
+or, addi, lw, sw, beq, bne), runs them on the emulator and on an independent
+reference interpreter, and shrinks every mismatch to a minimal reproducer.
+
+Usage: python fuzzer.py [--programs N] [--jobs N] [--seed N] [--engine fast|cycle] [--output DIR]
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass, replace
+from single_cycle_cpu import RiscV
+from rv_units.data_memory import DataMemory
+
+MEMORY_SIZE: int = 0x800 # Data memory of every fuzzed program
+MEMORY_WINDOW: int = 0x100 # Loads and stores fall in [base, base + window)
+MAX_STEPS: int = 10_000 # Instructions retired before a program is considered stuck
+
+# Registers with a fixed role, never written by random instructions
+BASE_REGISTER: int = 2 # Memory base, only set by the prologue
+LOOP_REGISTERS: tuple = (30, 31) # Loop counters, one per nesting level
+FREE_REGISTERS: tuple = tuple(r for r in range(1, 32)
+                              if r != BASE_REGISTER and r not in LOOP_REGISTERS)
+
+R_TYPE: tuple = ('add', 'sub', 'and', 'or')
+BRANCHES: tuple = ('beq', 'bne')
+INTERESTING_IMMEDIATES: tuple = (-2048, -1, 0, 1, 2047)
+
+
+@dataclass(frozen=True)
+class Instruction:
+    """A single instruction, branch offsets are in bytes"""
+    op: str
+    rd: int = 0
+    rs1: int = 0
+    rs2: int = 0
+    imm: int = 0
+
+    def __str__(self):
+        if self.op in R_TYPE:
+            return f'{self.op} x{self.rd}, x{self.rs1}, x{self.rs2}'
+        if self.op == 'addi':
+            return f'addi x{self.rd}, x{self.rs1}, {self.imm}'
+        if self.op == 'lw':
+            return f'lw x{self.rd}, {self.imm}(x{self.rs1})'
+        if self.op == 'sw':
+            return f'sw x{self.rs2}, {self.imm}(x{self.rs1})'
+        return f'{self.op} x{self.rs1}, x{self.rs2}, {self.imm}'
+
+
+@dataclass(frozen=True)
+class Skip:
+    """Forward branch over the next `items` items of the same body"""
+    op: str
+    rs1: int
+    rs2: int
+    items: int
+
+
+@dataclass(frozen=True)
+class Loop:
+    """Bounded loop running its body `count` times"""
+    count: int
+    body: tuple
+
+
+# -----Encoding-----
+
+def _bits(value: int, width: int) -> str:
+    """Two's complement binary string of value"""
+    return format(value & ((1 << width) - 1), f'0{width}b')
+
+
+def encode(ins: Instruction) -> str:
+    """Encode an instruction as the 32 character binary string the emulator loads"""
+    rd, rs1, rs2 = _bits(ins.rd, 5), _bits(ins.rs1, 5), _bits(ins.rs2, 5)
+    match ins.op:
+        case 'add':
+            return '0000000' + rs2 + rs1 + '000' + rd + '0110011'
+        case 'sub':
+            return '0100000' + rs2 + rs1 + '000' + rd + '0110011'
+        case 'and':
+            return '0000000' + rs2 + rs1 + '111' + rd + '0110011'
+        case 'or':
+            return '0000000' + rs2 + rs1 + '110' + rd + '0110011'
+        case 'addi':
+            return _bits(ins.imm, 12) + rs1 + '000' + rd + '0010011'
+        case 'lw':
+            return _bits(ins.imm, 12) + rs1 + '010' + rd + '0000011'
+        case 'sw':
+            imm = _bits(ins.imm, 12)
+            return imm[0:7] + rs2 + rs1 + '010' + imm[7:12] + '0100011'
+        case 'beq' | 'bne':
+            imm = _bits(ins.imm, 13)
+            funct3 = '000' if ins.op == 'beq' else '001'
+            return imm[0] + imm[2:8] + rs2 + rs1 + funct3 + imm[8:12] + imm[1] + '1100011'
+        case _:
+            raise ValueError(f'Invalid instruction: {ins.op}')
+
+
+def _length(items: tuple) -> int:
+    """Number of instructions the items assemble to"""
+    total = 0
+    for item in items:
+        if isinstance(item, Loop):
+            total += _length(item.body) + 3
+        else:
+            total += 1
+    return total
+
+
+def _assemble(items: tuple, depth: int) -> list:
+    """Assemble a body, resolving skips and loops to branches"""
+    out: list = []
+    for i, item in enumerate(items):
+        if isinstance(item, Skip):
+            offset = 4 * (_length(items[i + 1:i + 1 + item.items]) + 1)
+            out.append(Instruction(item.op, rs1=item.rs1, rs2=item.rs2, imm=offset))
+        elif isinstance(item, Loop):
+            counter = LOOP_REGISTERS[depth]
+            body = _assemble(item.body, depth + 1)
+            out.append(Instruction('addi', rd=counter, imm=item.count))
+            out.extend(body)
+            out.append(Instruction('addi', rd=counter, rs1=counter, imm=-1))
+            out.append(Instruction('bne', rs1=counter, rs2=0, imm=-4 * (len(body) + 1)))
+        else:
+            out.append(item)
+    return out
+
+
+def assemble(program: tuple) -> list:
+    """Assemble a program to a flat list of instructions"""
+    return _assemble(program, 0)
+
+
+# -----Generation-----
+
+def _immediate(rng: random.Random) -> int:
+    """Random 12-bit immediate, biased to small and boundary values"""
+    if rng.random() < 0.2:
+        return rng.choice(INTERESTING_IMMEDIATES)
+    if rng.random() < 0.7:
+        return rng.randint(-16, 16)
+    return rng.randint(-2048, 2047)
+
+
+def _source(rng: random.Random) -> int:
+    """Random source register, any register can be read"""
+    return rng.randrange(32)
+
+
+def _body(rng: random.Random, size: int, depth: int) -> tuple:
+    """Random body of about size items, with loops nested up to the loop registers"""
+    items: list = []
+    for _ in range(size):
+        roll = rng.random()
+        if roll < 0.1:
+            # Doubling in place, inside loops it reaches 32-bit overflow
+            rd = rng.choice(FREE_REGISTERS)
+            items.append(Instruction('add', rd=rd, rs1=rd, rs2=rd))
+        elif roll < 0.35:
+            items.append(Instruction(rng.choice(R_TYPE), rd=rng.choice(FREE_REGISTERS),
+                                     rs1=_source(rng), rs2=_source(rng)))
+        elif roll < 0.6:
+            items.append(Instruction('addi', rd=rng.choice(FREE_REGISTERS),
+                                     rs1=_source(rng), imm=_immediate(rng)))
+        elif roll < 0.7:
+            items.append(Instruction('lw', rd=rng.choice(FREE_REGISTERS), rs1=BASE_REGISTER,
+                                     imm=4 * rng.randrange(MEMORY_WINDOW // 4)))
+        elif roll < 0.8:
+            items.append(Instruction('sw', rs1=BASE_REGISTER, rs2=_source(rng),
+                                     imm=4 * rng.randrange(MEMORY_WINDOW // 4)))
+        elif roll < 0.92:
+            items.append(Skip(rng.choice(BRANCHES), _source(rng), _source(rng),
+                              rng.randint(0, 3)))
+        elif depth < len(LOOP_REGISTERS):
+            items.append(Loop(rng.randint(1, 8), _body(rng, rng.randint(1, 6), depth + 1)))
+    return tuple(items)
+
+
+def generate(rng: random.Random, size: int = 16) -> tuple:
+    """Random program, starting with a prologue that sets the memory base"""
+    base = 4 * rng.randrange((MEMORY_SIZE - MEMORY_WINDOW) // 4)
+    return (Instruction('addi', rd=BASE_REGISTER, imm=base),) + _body(rng, size, 0)
+
+
+# -----Reference interpreter-----
+
+def reference_run(instructions: list, max_steps: int = MAX_STEPS) -> tuple:
+    """Run instructions on a plain RV32 model, returns (registers, memory, halted)"""
+    regs = [0] * 32
+    memory = bytearray(MEMORY_SIZE)
+    pc = 0
+    steps = 0
+    while 0 <= pc // 4 < len(instructions) and steps < max_steps:
+        ins = instructions[pc // 4]
+        a, b = regs[ins.rs1], regs[ins.rs2]
+        result = None
+        next_pc = pc + 4
+        if ins.op == 'add':
+            result = a + b
+        elif ins.op == 'sub':
+            result = a - b
+        elif ins.op == 'and':
+            result = a & b
+        elif ins.op == 'or':
+            result = a | b
+        elif ins.op == 'addi':
+            result = a + ins.imm
+        elif ins.op == 'lw':
+            result = int.from_bytes(memory[a + ins.imm:a + ins.imm + 4], 'little', signed=True)
+        elif ins.op == 'sw':
+            memory[a + ins.imm:a + ins.imm + 4] = (b & 0xFFFFFFFF).to_bytes(4, 'little')
+        elif (ins.op == 'beq') == (a == b):
+            next_pc = pc + ins.imm
+        if result is not None and ins.rd != 0:
+            result &= 0xFFFFFFFF
+            regs[ins.rd] = result - (1 << 32) if result >> 31 else result
+        pc = next_pc
+        steps += 1
+    return regs, bytes(memory), steps < max_steps
+
+
+# -----Checking and shrinking-----
+
+def check(program: tuple, engine: str = 'fast') -> str | None:
+    """Run a program on the emulator and the reference, returns a description of any mismatch"""
+    instructions = assemble(program)
+    expected_regs, expected_mem, expected_halt = reference_run(instructions)
+    with DataMemory(MEMORY_SIZE) as data_mem:
+        risc_v = RiscV(data_mem)
+        try:
+            risc_v.load_instructions(encode(ins) for ins in instructions)
+            if engine == 'fast':
+                halted = not risc_v.run(MAX_STEPS)
+            else:
+                steps = 0
+                while steps < MAX_STEPS and risc_v.cycle():
+                    steps += 1
+                halted = steps < MAX_STEPS
+        except Exception as e: # pylint: disable=broad-except
+            return f'Emulator raised {type(e).__name__}: {e}'
+        regs = [int(risc_v.registers.get_reg(i)) for i in range(32)]
+        memory = data_mem.extract()
+    if halted != expected_halt:
+        return f'Emulator halted: {halted}, reference halted: {expected_halt}'
+    for i, (got, expected) in enumerate(zip(regs, expected_regs)):
+        if got != expected:
+            return f'x{i} = {got}, expected {expected}'
+    if memory != expected_mem:
+        address = next(i for i, (a, b) in enumerate(zip(memory, expected_mem)) if a != b)
+        return f'Data memory differs at {hex(address)}'
+    return None
+
+
+def _candidates(items: tuple, depth: int = 0):
+    """Yield smaller variants of a body, simplest first"""
+    for i in range(len(items)):
+        yield items[:i] + items[i + 1:]
+    for i, item in enumerate(items):
+        variants: list = []
+        if isinstance(item, Loop):
+            variants.append(item.body)
+            if item.count > 1:
+                variants.append((replace(item, count=1),))
+            variants.extend((replace(item, body=body),)
+                            for body in _candidates(item.body, depth + 1))
+        elif isinstance(item, Skip):
+            if item.items > 0:
+                variants.append((replace(item, items=item.items - 1),))
+            if item.rs1 or item.rs2:
+                variants.append((replace(item, rs1=0, rs2=0),))
+        else:
+            if item.imm:
+                # Addresses and the memory base stay word aligned
+                aligned = item.op in ('lw', 'sw') or item.rd == BASE_REGISTER
+                step = 4 if aligned else 1
+                variants.append((replace(item, imm=0),))
+                variants.append((replace(item, imm=item.imm // 2 // step * step),))
+            if item.rs1 and item.rs1 != BASE_REGISTER:
+                variants.append((replace(item, rs1=0),))
+            if item.rs2:
+                variants.append((replace(item, rs2=0),))
+        for variant in variants:
+            yield items[:i] + tuple(variant) + items[i + 1:]
+
+
+def shrink(program: tuple, engine: str = 'fast') -> tuple:
+    """Greedily shrink a failing program while it keeps failing"""
+    progress = True
+    while progress:
+        progress = False
+        for candidate in _candidates(program):
+            if candidate != program and check(candidate, engine) is not None:
+                program = candidate
+                progress = True
+                break
+    return program
+
+
+# -----Driver-----
+
+def _fuzz_batch(args: tuple) -> list:
+    """Fuzz count programs from consecutive seeds, returns (seed, reason, reproducer) failures"""
+    first_seed, count, engine = args
+    failures: list = []
+    for seed in range(first_seed, first_seed + count):
+        program = generate(random.Random(seed))
+        if check(program, engine) is None:
+            continue
+        program = shrink(program, engine)
+        failures.append((seed, check(program, engine), assemble(program)))
+    return failures
+
+
+def fuzz(programs: int, jobs: int, seed: int = 0, engine: str = 'fast', batch: int = 200) -> list:
+    """Fuzz programs random programs over jobs processes, returns the shrunk failures"""
+    tasks = [(first, min(batch, seed + programs - first), engine)
+             for first in range(seed, seed + programs, batch)]
+    failures: list = []
+    if jobs == 1:
+        for task in tasks:
+            failures.extend(_fuzz_batch(task))
+        return failures
+    with multiprocessing.Pool(jobs) as pool:
+        for result in pool.imap_unordered(_fuzz_batch, tasks):
+            failures.extend(result)
+    return sorted(failures, key=lambda failure: failure[0])
+
+
+def _main() -> int:
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Fuzz the emulator against a reference model')
+    parser.add_argument('--programs', type=int, default=10_000, help='Programs to generate')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='First seed')
+    parser.add_argument('--engine', choices=('fast', 'cycle'), default='fast',
+                        help='Emulator engine under test')
+    parser.add_argument('--output', help='Directory to write loadable reproducers to')
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+
+    start_time = time.time()
+    failures = fuzz(args.programs, args.jobs, args.seed, args.engine)
+    execution_time = time.time() - start_time
+
+    for seed, reason, instructions in failures:
+        print(f'Seed {seed}: {reason}')
+        for address, ins in enumerate(instructions):
+            print(f'    {address * 4:4x}: {encode(ins)}  {ins}')
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+            with open(os.path.join(args.output, f'seed_{seed}.txt'), 'w', encoding='utf-8') as f:
+                f.writelines(encode(ins) + '\n' for ins in instructions)
+    print(f'{args.programs} programs, {len(failures)} failures in {execution_time:.2f} s '
+          f'({args.programs / execution_time:.0f} programs/s on {args.jobs} processes)')
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -30,19 +30,19 @@ def _main() -> int:
                             handlers=[logging.FileHandler("debug.log")]
                             )
 
-    risc_v = RiscV()
     file_path = filedialog.askopenfilename() # Won't work with TUI
 
-    try:
-        risc_v.load_program(file_path)
-    except ValueError as e:
-        print(f'Failed to load program: {e}')
-        return 1
+    with RiscV() as risc_v:
+        try:
+            risc_v.load_program(file_path)
+        except ValueError as e:
+            print(f'Failed to load program: {e}')
+            return 1
 
-    start_time = time.time()
-    while risc_v.cycle():
-        pass
-    end_time = time.time()
+        start_time = time.time()
+        while risc_v.cycle():
+            pass
+        end_time = time.time()
     execution_time = end_time - start_time
     print(f'Execution time: {execution_time/1000} s')
     
@@ -0,0 +1,168 @@
+"""Runtime metrics for the RV32 Single Cycle Emulator.
+
+A MetricsSampler reads the performance counters of a running emulator from
+a background thread and keeps a sliding window of samples to compute the
+instructions per second. A MetricsServer exposes the samples as a
+Prometheus text endpoint on localhost.
+
+    with RiscV() as risc_v, MetricsSampler(risc_v.counters) as sampler, \\
+            MetricsServer(sampler, port=9100):
+        risc_v.load_program(file_path)
+        risc_v.run()
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from rv_units.performance_counters import PerformanceCounters
+
+# Prometheus name, type and help of every exported counter
+_EXPORTED: tuple = (
+    ('cycles', 'rv_cycles_total', 'counter', 'Clock cycles'),
+    ('retired', 'rv_instructions_retired_total', 'counter', 'Instructions retired'),
+    ('loads', 'rv_loads_total', 'counter', 'Data memory loads'),
+    ('stores', 'rv_stores_total', 'counter', 'Data memory stores'),
+    ('bytes_read', 'rv_memory_read_bytes_total', 'counter', 'Bytes read from data memory'),
+    ('bytes_written', 'rv_memory_written_bytes_total', 'counter', 'Bytes written to data memory'),
+    ('branches', 'rv_branches_total', 'counter', 'Branches executed'),
+    ('branches_taken', 'rv_branches_taken_total', 'counter', 'Branches taken'),
+    ('ips', 'rv_instructions_per_second', 'gauge', 'Instructions per second over the window'),
+    ('stalled_seconds', 'rv_stalled_seconds', 'gauge', 'Seconds since an instruction retired'),
+)
+
+
+def _escape(value) -> str:
+    """Escape a label value for the Prometheus text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsSampler():
+    """Samples performance counters periodically from a background thread"""
+    def __init__(self,
+                 counters: PerformanceCounters,
+                 interval: float = 1.0,
+                 window: float = 10.0,
+                 labels: dict | None = None):
+        self._counters: PerformanceCounters = counters
+        self._interval: float = interval
+        self._window: float = window
+        self.labels: dict = labels or {} # Added to every exported sample, e.g. {'guest': 'sort'}
+        self._samples: deque = deque() # (time, retired) inside the window
+        self._last_progress: float = time.monotonic()
+        self._lock: threading.Lock = threading.Lock()
+        self._stop: threading.Event = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """Start sampling in a daemon thread"""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='rv-metrics', daemon=True)
+        self._thread.start()
+        logging.debug('[Metrics] Sampling every %s s', self._interval)
+
+    def stop(self) -> None:
+        """Stop the sampling thread"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _loop(self) -> None:
+        """Body of the sampling thread"""
+        while True:
+            self.sample()
+            if self._stop.wait(self._interval):
+                return
+
+    def sample(self) -> None:
+        """Take a sample now and drop the ones older than the window"""
+        now = time.monotonic()
+        retired = self._counters.retired
+        with self._lock:
+            if not self._samples or self._samples[-1][1] != retired:
+                self._last_progress = now
+            self._samples.append((now, retired))
+            while len(self._samples) > 2 and now - self._samples[0][0] > self._window:
+                self._samples.popleft()
+
+    def snapshot(self) -> dict:
+        """The counters plus instructions per second and seconds without progress"""
+        values = self._counters.snapshot()
+        now = time.monotonic()
+        with self._lock:
+            ips = 0.0
+            if len(self._samples) > 1:
+                (first_time, first), (last_time, last) = self._samples[0], self._samples[-1]
+                if last_time > first_time:
+                    ips = (last - first) / (last_time - first_time)
+            values['ips'] = ips
+            values['stalled_seconds'] = now - self._last_progress
+        return values
+
+    def prometheus(self) -> str:
+        """Snapshot in the Prometheus text exposition format"""
+        values = self.snapshot()
+        labels = ','.join(f'{key}="{_escape(value)}"' for key, value in self.labels.items())
+        labels = f'{{{labels}}}' if labels else ''
+        lines: list = []
+        for field, name, kind, description in _EXPORTED:
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.append(f'{name}{labels} {values[field]}')
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer():
+    """Serves a sampler on http://host:port/metrics from a daemon thread"""
+    def __init__(self, sampler: MetricsSampler, port: int = 9100, host: str = '127.0.0.1'):
+        class Handler(BaseHTTPRequestHandler):
+            """Request handler bound to the sampler"""
+            def do_GET(self): # pylint: disable=invalid-name
+                """Reply with the metrics"""
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = sampler.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args): # pylint: disable=redefined-builtin
+                logging.debug('[Metrics] ' + format, *args)
+
+        self._server: ThreadingHTTPServer = ThreadingHTTPServer((host, port), Handler)
+        self._thread: threading.Thread = threading.Thread(
+            target=self._server.serve_forever, name='rv-metrics-http', daemon=True)
+        self._thread.start()
+        logging.debug('[Metrics] Serving on http://%s:%s/metrics', host, self.port)
+
+    @property
+    def port(self) -> int:
+        """Port the server listens on, useful when created with port 0"""
+        return self._server.server_address[1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stop serving"""
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
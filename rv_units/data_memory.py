@@ -1,48 +1,366 @@
 """Data Memory for the RV32 Single Cycle Emulator"""
 import logging
+import mmap
+import os
+import weakref
+from multiprocessing import shared_memory
 from rv_units.register_file import DataRegister
 
+DEFAULT_SIZE: int = 0x10000 # 64 KiB
 
-class DataMemory():
-    """Data Memory class"""
-    def __init__(self):
+
+def _released(export) -> bool:
+    """True if a view or array handed out was released or garbage collected"""
+    if export is None:
+        return True
+    if isinstance(export, memoryview):
+        try:
+            export.nbytes # pylint: disable=pointless-statement
+        except ValueError: # Raised by released views
+            return True
+    return False
+
+
+def _grow(file, size: int, path: str) -> None:
+    """Extend a memory file with zeros to size bytes, never cutting a saved image"""
+    length = os.fstat(file.fileno()).st_size
+    if length > size:
+        raise ValueError(f'Data memory file {path} holds {length} bytes, '
+                         f'more than the {size} bytes of the memory')
+    if length < size:
+        file.truncate(size)
+
+
+class _BufferBackend():
+    """Backend that keeps the data memory in a writable buffer"""
+    def __init__(self, buffer) -> None:
+        self.buffer: memoryview = memoryview(buffer)
+
+    def read(self, address: int, length: int) -> bytes:
+        """Read length bytes starting at address"""
+        return self.buffer[address:address + length].tobytes()
+
+    def write(self, address: int, data: bytes) -> None:
+        """Write data starting at address"""
+        self.buffer[address:address + len(data)] = data
+
+    def view(self, address: int, length: int) -> memoryview:
+        """Zero-copy view of length bytes starting at address"""
+        return self.buffer[address:address + length]
+
+    def close(self) -> None:
+        """Release the buffer"""
+        self.buffer.release()
+
+
+class AnonymousBackend(_BufferBackend):
+    """Data memory kept in a private bytearray (default)"""
+    def __init__(self, size: int) -> None:
+        super().__init__(bytearray(size))
+
+
+class MmapBackend(_BufferBackend):
+    """Data memory mapped from a named file, or an anonymous mapping if no path is given"""
+    def __init__(self, size: int, path: str | None = None) -> None:
+        self._file = None
+        if path is None:
+            self._map = mmap.mmap(-1, size)
+        else:
+            self._file = open(path, 'a+b') # Creates the file without truncating it
+            try:
+                _grow(self._file, size, path)
+                self._map = mmap.mmap(self._file.fileno(), size)
+            except Exception:
+                self._file.close()
+                raise
+        super().__init__(self._map)
+
+    def close(self) -> None:
         try:
-            self._data_mem = open('data_memory.bin', 'r+b') #type: ignore
-            logging.debug('[Emulator] Data Memory file found')
+            super().close()
+            self._map.close()
+        finally:
+            if self._file is not None:
+                self._file.close()
+
+
+class SharedMemoryBackend(_BufferBackend):
+    """Data memory in a named shared memory block, attached to if it already exists"""
+    def __init__(self, size: int, name: str | None = None) -> None:
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self._owner: bool = True
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._owner = False
+        if self._shm.size < size:
+            self._shm.close()
+            raise ValueError(f'Shared memory {name} is smaller than {size} bytes')
+        super().__init__(self._shm.buf[:size])
+
+    @property
+    def name(self) -> str:
+        """Name of the shared memory block, to be attached from other processes"""
+        return self._shm.name
+
+    def close(self) -> None:
+        try:
+            super().close()
+            self._shm.close()
+        finally:
+            if self._owner:
+                self._owner = False
+                self._shm.unlink()
+
+
+class FileBackend():
+    """Data memory stored in a named file, accessed through a single open handle"""
+    def __init__(self, size: int, path: str) -> None:
+        try:
+            self._file = open(path, 'r+b')
+            logging.debug('[Data Memory] Data Memory file found')
         except FileNotFoundError:
-            self._data_mem = open('data_memory.bin', 'w+b')
-            logging.debug('[Emulator] Data Memory file not found, creating a new one')
+            self._file = open(path, 'w+b')
+            logging.debug('[Data Memory] Data Memory file not found, creating a new one')
+        try:
+            _grow(self._file, size, path)
+        except Exception:
+            self._file.close()
+            raise
+
+    def read(self, address: int, length: int) -> bytes:
+        """Read length bytes starting at address"""
+        self._file.seek(address)
+        return self._file.read(length)
+
+    def write(self, address: int, data: bytes) -> None:
+        """Write data starting at address"""
+        self._file.seek(address)
+        self._file.write(data)
+
+    def view(self, address: int, length: int) -> memoryview:
+        """Files can't be viewed in place"""
+        raise ValueError('File backend has no zero-copy view, use extract instead')
+
+    def close(self) -> None:
+        """Close the memory file"""
+        self._file.close()
+
+
+class DataMemory():
+    """Data Memory class
+
+    backend selects where the memory lives:
+        'memory' -> private bytearray (default)
+        'file'   -> named file at path
+        'mmap'   -> memory mapped file at path, or anonymous mapping if path is None
+        'shm'    -> shared memory block named path (created or attached)
+    Files must not be larger than size, smaller ones are extended with zeros.
+    image, a bytes-like object, is copied to address 0 after the backend is opened.
+    """
+    def __init__(self,
+                 size: int = DEFAULT_SIZE,
+                 backend: str = 'memory',
+                 path: str | None = None,
+                 image: bytes | None = None):
+        if size <= 0:
+            raise ValueError('Data memory size must be positive')
+        if image is not None and memoryview(image).nbytes > size:
+            raise ValueError('Initial image is larger than the data memory')
+        match backend:
+            case 'memory':
+                self._backend = AnonymousBackend(size)
+            case 'file':
+                if path is None:
+                    raise ValueError('File backend requires a path')
+                self._backend = FileBackend(size, path)
+            case 'mmap':
+                self._backend = MmapBackend(size, path)
+            case 'shm':
+                self._backend = SharedMemoryBackend(size, path)
+            case _:
+                raise ValueError(f'Invalid data memory backend: {backend}')
+        self._size: int = size
+        self._closed: bool = False
+        self._views: list = [] # Weak references to the views and arrays handed out
+        logging.debug('[Data Memory] Opened %s backend with %s bytes', backend, size)
+
+        if image is not None:
+            self.load(0, image)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
 
     def __del__(self):
-        self._data_mem.close()
+        try:
+            self.close()
+        except BufferError:
+            pass # Views still in use keep the backend buffer alive
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def size(self) -> int:
+        """Size of the data memory in bytes"""
+        return self._size
+
+    @property
+    def closed(self) -> bool:
+        """True once the backend has been released"""
+        return self._closed
+
+    def close(self) -> None:
+        """Release the backend, it's safe to call more than once"""
+        if getattr(self, '_closed', True):
+            return
+        self._views = [ref for ref in self._views if not _released(ref())]
+        if self._views:
+            # The memory stays open, close can be retried once the views are released
+            raise BufferError('Data memory views are still in use, release them before closing')
+        self._backend.close()
+        self._closed = True
+        logging.debug('[Data Memory] Backend closed')
+
+    def _check_range(self, address: int, length: int) -> None:
+        """Raise if the access falls outside of the data memory"""
+        if self._closed:
+            raise ValueError('Data memory is closed')
+        if address < 0 or length < 0 or address + length > self._size:
+            raise ValueError(f'Address {hex(address)} out of data memory range')
 
     def write(self, address: int, data: DataRegister) -> None:
         """Write data to the cache memory"""
         logging.debug('[Data Memory] Writing data to address %s (%s)', hex(address), address)
-        with open('data_memory.bin', 'r+b') as f:
-            f.seek(address)
-            f.write(int(data).to_bytes(4, 'little', signed=True))
+        self._check_range(address, 4)
+        self._backend.write(address, int(data).to_bytes(4, 'little', signed=True))
 
     def read(self, address: int) -> DataRegister:
         """Read data from the cache memory"""
         logging.debug('[Data Memory] Reading data from address %s (%s)', hex(address), address)
-        with open('data_memory.bin', 'r+b') as f:
-            f.seek(address)
-            retrieved = f.read(4)
+        self._check_range(address, 4)
+        retrieved = self._backend.read(address, 4)
         logging.debug('[Data Memory] Retrieved data: %s | %s',
                       int.from_bytes(retrieved, 'little', signed=True),
                       retrieved.hex())
         data = int.from_bytes(retrieved, 'little', signed=True)
         return DataRegister(data)
 
+    def _resolve(self, address: int, length: int | None) -> int:
+        """Return the length of an access, up to the end of the memory if None"""
+        if length is None:
+            length = self._size - address
+        self._check_range(address, length)
+        return length
+
+    def load(self, address: int, data) -> None:
+        """Copy a bytes-like object (bytes, memoryview, array, NumPy array...) to address"""
+        source = memoryview(data)
+        if source.c_contiguous:
+            source = source.cast('B')
+        else:
+            source = memoryview(source.tobytes()) # Strided arrays can't be cast in place
+        self._check_range(address, len(source))
+        logging.debug('[Data Memory] Loading %s bytes at address %s', len(source), hex(address))
+        self._backend.write(address, source)
+
+    def extract(self, address: int = 0, length: int | None = None) -> bytes:
+        """Copy length bytes starting at address, up to the end of the memory by default"""
+        length = self._resolve(address, length)
+        return self._backend.read(address, length)
+
+    def view(self, address: int = 0, length: int | None = None) -> memoryview:
+        """Writable zero-copy view of the memory, not available on the file backend
+
+        The view must be released (or dropped) before the memory is closed,
+        close raises BufferError otherwise.
+        """
+        length = self._resolve(address, length)
+        return self._export(self._backend.view(address, length))
+
+    def _export(self, export):
+        """Keep track of a view or array handed out, close refuses to run while it's in use"""
+        self._views = [ref for ref in self._views if not _released(ref())]
+        self._views.append(weakref.ref(export))
+        return export
+
+    def as_array(self, dtype='<i4', address: int = 0, count: int = -1):
+        """NumPy array over the memory
+
+        Zero-copy and writable, except on the file backend where it's a
+        read-only copy since writes to it wouldn't reach the memory.
+        """
+        try:
+            import numpy as np # pylint: disable=import-outside-toplevel
+        except ImportError as e:
+            raise ImportError('as_array requires numpy to be installed') from e
+        dtype = np.dtype(dtype)
+        length = None if count < 0 else count * dtype.itemsize
+        length = self._resolve(address, length)
+        if isinstance(self._backend, FileBackend):
+            array = np.frombuffer(bytearray(self._backend.read(address, length)), dtype)
+            array.setflags(write=False)
+            return array
+        return self._export(np.frombuffer(self._backend.view(address, length), dtype))
+
+    def memset(self, address: int, value: int, length: int) -> None:
+        """Fill length bytes starting at address with value"""
+        if not 0 <= value <= 0xFF:
+            raise ValueError('memset value must fit in a byte')
+        self._check_range(address, length)
+        self._backend.write(address, bytes((value,)) * length)
+
+    def memcpy(self, destination: int, source: int, length: int) -> None:
+        """Copy length bytes from source to destination, the regions may overlap"""
+        self._check_range(source, length)
+        self._check_range(destination, length)
+        self._backend.write(destination, self._backend.read(source, length))
+
+    def _read_int(self, address: int, size: int, signed: bool) -> int:
+        """Read an aligned little endian integer of size bytes"""
+        if address % size:
+            raise ValueError(f'Misaligned {size} byte read at address {hex(address)}')
+        self._check_range(address, size)
+        return int.from_bytes(self._backend.read(address, size), 'little', signed=signed)
+
+    def _write_int(self, address: int, size: int, value: int) -> None:
+        """Write an aligned little endian integer of size bytes, keeping the low bits"""
+        if address % size:
+            raise ValueError(f'Misaligned {size} byte write at address {hex(address)}')
+        self._check_range(address, size)
+        value &= (1 << (8 * size)) - 1
+        self._backend.write(address, value.to_bytes(size, 'little'))
+
+    def read_word(self, address: int, signed: bool = True) -> int:
+        """Read a 32-bit word, address must be 4 byte aligned"""
+        return self._read_int(address, 4, signed)
+
+    def write_word(self, address: int, value: int) -> None:
+        """Write a 32-bit word, address must be 4 byte aligned"""
+        self._write_int(address, 4, value)
+
+    def read_half(self, address: int, signed: bool = True) -> int:
+        """Read a 16-bit halfword, address must be 2 byte aligned"""
+        return self._read_int(address, 2, signed)
+
+    def write_half(self, address: int, value: int) -> None:
+        """Write a 16-bit halfword, address must be 2 byte aligned"""
+        self._write_int(address, 2, value)
+
+    def read_byte(self, address: int, signed: bool = True) -> int:
+        """Read a single byte"""
+        return self._read_int(address, 1, signed)
+
+    def write_byte(self, address: int, value: int) -> None:
+        """Write a single byte"""
+        self._write_int(address, 1, value)
+
     def dump(self) -> None:
         """Dump the data memory"""
         logging.debug('[Data Memory] Dumping data memory')
-        with open('data_memory.bin', 'r+b') as f:
-            f.seek(0)
-            data = f.read()
+        self._check_range(0, 0)
+        data = self._backend.read(0, self._size)
         logging.debug('[Data Memory] Data: %s', data.hex())
-
-    def seek(self, address) -> None:
-        """Seek to a specific address"""
-        self._data_mem.seek(address)
\ No newline at end of file
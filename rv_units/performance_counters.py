@@ -0,0 +1,45 @@
+"""Performance counters for the RV32 Single Cycle Emulator"""
+
+FIELDS: tuple = ('cycles', 'retired', 'loads', 'stores',
+                 'bytes_read', 'bytes_written', 'branches', 'branches_taken')
+
+
+class PerformanceCounters():
+    """Monotonic counters of the work done by the CPU, like the RISC-V cycle/instret CSRs
+
+    Only the thread running the CPU adds to the counters. Every update
+    publishes all the values as a single tuple, so other threads always
+    read a consistent set of values without locking.
+    """
+    def __init__(self):
+        self._values: tuple = (0,) * len(FIELDS)
+
+    def add(self, retired: int, loads: int = 0, stores: int = 0,
+            branches: int = 0, taken: int = 0) -> None:
+        """Account for retired instructions, a single cycle CPU takes one cycle for each"""
+        values = self._values
+        self._values = (values[0] + retired,
+                        values[1] + retired,
+                        values[2] + loads,
+                        values[3] + stores,
+                        values[4] + 4 * loads, # Only word accesses are supported
+                        values[5] + 4 * stores,
+                        values[6] + branches,
+                        values[7] + taken)
+
+    @property
+    def cycles(self) -> int:
+        """Clock cycles since the CPU was created"""
+        return self._values[0]
+
+    @property
+    def retired(self) -> int:
+        """Instructions retired since the CPU was created"""
+        return self._values[1]
+
+    def snapshot(self) -> dict:
+        """All the counters, read atomically"""
+        return dict(zip(FIELDS, self._values))
+
+    def __str__(self):
+        return ' | '.join(f'{name}: {value}' for name, value in self.snapshot().items())
@@ -10,7 +10,12 @@ class DataRegister():
         if isinstance(data, bytearray):
             self.data: bytearray = data# 32 bits
             return
-        self.data = data.to_bytes(4, byteorder='big', signed=True) # type: ignore
+        self.data = self.wrap(data).to_bytes(4, byteorder='big', signed=True) # type: ignore
+
+    @staticmethod
+    def wrap(value: int) -> int:
+        """Wrap an integer to 32-bit two's complement, like the hardware does on overflow"""
+        return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
 
     def __str__(self):
         # Printing all the bits
@@ -28,7 +33,7 @@ class DataRegister():
 
     def write_int(self, value: int) -> None:
         """Write an integer to the register"""
-        self.data = value.to_bytes(4, byteorder='big', signed=True) # type: ignore
+        self.data = self.wrap(value).to_bytes(4, byteorder='big', signed=True) # type: ignore
 
     def wipe(self) -> None:
         """Set all bits to 0"""
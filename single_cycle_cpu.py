@@ -2,10 +2,12 @@
 
 import logging
 import struct
+import sys
 from rv_units.control_unit import ControlUnit
 from rv_units.register_file import RegisterFile, DataRegister
 from rv_units.alu import ALU, ADDER
 from rv_units.data_memory import DataMemory
+from rv_units.performance_counters import PerformanceCounters
 
 class MUX:
     """This class represents a Multiplexer"""
@@ -38,14 +40,36 @@ class MUX:
         return f'Input0: {self._input0} | Input1: {self._input1} | Select: {self._select}'
 
 
+# Instructions the fast engine retires between updates of the performance counters
+_COUNTERS_INTERVAL: int = 4096
+
+# Operations of the fast engine decoder
+_ADD, _SUB, _AND, _OR, _ADDI, _LW, _SW, _BEQ, _BNE, _TRAP = range(10)
+
+_R_TYPE_OPS: dict = {0b000: _ADD, 0b111: _AND, 0b110: _OR}
+
+
+def _signed(bits: str) -> int:
+    """Sign extend a binary string"""
+    value = int(bits, 2)
+    if bits[0] == '1':
+        value -= 1 << len(bits)
+    return value
+
+
 class RiscV:
     """This class represents a Risc-V Single Cycle CPU simulator."""
-    def __init__(self):
+    def __init__(self, data_mem: DataMemory | None = None):
         self._imem: dict = {} # This is a dictionary of instructions
+        self._blocks: dict = {} # Decoded basic blocks for the fast engine
+        self._traps: list = [] # Messages of the traps in the decoded blocks, by their imm
+        self._block_breakpoints: frozenset = frozenset() # Addresses the blocks are split at
+        self.counters: PerformanceCounters = PerformanceCounters() # Never reset
         self._cycle_counter: int = 1 # For debugging purposes
 
-        # Cache Memory on binary file
-        self._data_mem = DataMemory()
+        # Data Memory, private and in-memory unless one is provided
+        self._owns_data_mem: bool = data_mem is None
+        self._data_mem: DataMemory = DataMemory() if data_mem is None else data_mem
 
         self._control: ControlUnit = ControlUnit() # Control Unit
         self._registers: RegisterFile = RegisterFile() # Register File
@@ -57,9 +81,35 @@ class RiscV:
         self.pc: DataRegister = self._registers.zero()  # Program Counter
         self._pc_sel: MUX = MUX()  # Program Counter Multiplexer
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
     def __del__(self):
-        logging.debug('[Emulator] Closing data memory file')
-        self._data_mem.__del__()
+        self.close()
+
+    def close(self) -> None:
+        """Close the data memory if it was created by this emulator"""
+        if getattr(self, '_owns_data_mem', False) and not self._data_mem.closed:
+            logging.debug('[Emulator] Closing data memory')
+            self._data_mem.close()
+
+    @property
+    def data_memory(self) -> DataMemory:
+        """The data memory attached to this emulator"""
+        return self._data_mem
+
+    @property
+    def registers(self) -> RegisterFile:
+        """The register file of this emulator"""
+        return self._registers
+
+    @property
+    def retired(self) -> int:
+        """Number of instructions retired since the emulator was created"""
+        return self.counters.retired
 
     def pc_value(self) -> int:
         """Returns the current value of the program counter register"""
@@ -78,16 +128,13 @@ class RiscV:
             raise ValueError('Program path was not provided')
         logging.debug('[Emulator] Loading memory from %s', file_name)
         with open(file_name, encoding='utf-8') as f:
-            temp_last_addr = 0
-            for i, line in enumerate(f):
-                if line == "\n":
-                    continue
-                if i == 0:
-                    addr = format(i, '02x')
-                else:
-                    temp_last_addr = temp_last_addr + 4
-                    addr = format(temp_last_addr, '02x')
-                self._imem.update({addr: line.rstrip()})
+            self.load_instructions(line for line in f if line != "\n")
+
+    def load_instructions(self, instructions) -> None:
+        """Load 32 character binary instructions, one every 4 bytes starting at 0x00"""
+        for i, instruction in enumerate(instructions):
+            self._imem.update({format(i * 4, '02x'): instruction.rstrip()})
+        self._clear_blocks()
         logging.debug('[Emulator] Loaded %d instructions', len(self._imem))
 
     def instruction_at_address(self, address: int):
@@ -304,4 +351,221 @@ class RiscV:
             logging.debug('[CPU] Branching to %s', hex(int(pc_add_offset)))
         logging.debug('[CPU] End of cycle\n')
         self._cycle_counter += 1
+        self.counters.add(1,
+                          loads=int(self._control.mem_read),
+                          stores=int(self._control.mem_write),
+                          branches=int(self._control.branch),
+                          taken=int(getattr(self._pc_sel, '_select')))
         return True
+
+    def _clear_blocks(self) -> None:
+        """Drop the decoded blocks and the messages of their traps"""
+        self._blocks.clear()
+        self._traps.clear()
+
+    def _trap(self, message: str) -> tuple[int, int, int, int, int]:
+        """Decoded trap, its imm indexes the message raised when it executes"""
+        self._traps.append(message)
+        return (_TRAP, 0, 0, 0, len(self._traps) - 1)
+
+    def decode(self, instruction: str) -> tuple[int, int, int, int, int]:
+        """Decode an instruction to (operation, rd, rs1, rs2, imm) for the fast engine
+
+        Instructions the data path can't execute, malformed lines included,
+        decode to a trap, so the fault only fires when execution reaches them.
+        """
+        try:
+            return self._decode_fields(instruction)
+        except ValueError as e:
+            return self._trap(f'Malformed instruction {instruction!r}: {e}')
+
+    def _decode_fields(self, instruction: str) -> tuple[int, int, int, int, int]:
+        """Decode the fields of an instruction, raises ValueError if they aren't binary"""
+        opcode: str = instruction[25:32]
+        rd: int = int(instruction[20:25], 2)
+        rs1: int = int(instruction[12:17], 2)
+        rs2: int = int(instruction[7:12], 2)
+        funct3: int = int(instruction[17:20], 2)
+        match opcode:
+            case '0110011': # R-type
+                if int(instruction[0:7], 2) == 0b0100000:
+                    decoded = (_SUB, rd, rs1, rs2, 0)
+                elif funct3 in _R_TYPE_OPS:
+                    decoded = (_R_TYPE_OPS[funct3], rd, rs1, rs2, 0)
+                else:
+                    return self._trap('Invalid function code')
+            case '0010011': # ADDI
+                decoded = (_ADDI, rd, rs1, 0, _signed(instruction[0:12]))
+            case '0000011': # LW
+                decoded = (_LW, rd, rs1, 0, _signed(instruction[0:12]))
+            case '0100011': # SW
+                return (_SW, 0, rs1, rs2, _signed(instruction[0:7] + instruction[20:25]))
+            case '1100011': # BEQ | BNE
+                if funct3 > 0b001:
+                    return self._trap('Invalid branch condition')
+                return (_BEQ if funct3 == 0b000 else _BNE, 0, rs1, rs2,
+                        _signed(instruction[0] + instruction[24] +
+                                instruction[1:7] + instruction[20:24] + '0'))
+            case _:
+                return self._trap(f'Opcode not recognized: {opcode}')
+        if rd == 0:
+            return self._trap('Cannot write to x0')
+        return decoded
+
+    def _build_block(self, address: int) -> tuple:
+        """Decode the basic block starting at address, empty if there's no instruction there
+
+        A block ends after a branch, before an address without instruction
+        or before a breakpoint. Branch targets are stored as absolute addresses.
+        """
+        block: list = []
+        start: int = address
+        while (instruction := self._imem.get(format(address, '02x'))) is not None:
+            if address != start and address in self._block_breakpoints:
+                break
+            decoded = self.decode(instruction)
+            if decoded[0] in (_BEQ, _BNE):
+                block.append(decoded[:4] + (address + decoded[4],))
+                break
+            block.append(decoded)
+            address += 4
+        return tuple(block)
+
+    def run(self,
+            max_cycles: int | None = None,
+            breakpoints: frozenset = frozenset(),
+            watch=None,
+            conditions: dict | None = None,
+            undo: dict | None = None) -> bool:
+        """Run the program on the fast engine until it halts or max_cycles instructions retire
+
+        The fast engine executes predecoded basic blocks on plain integers,
+        with no per-cycle logging, and leaves the same architectural state
+        (registers, data memory and PC) as calling cycle() in a loop,
+        except that loads and stores must be word aligned.
+
+        The run also stops before executing an address in breakpoints.
+        Blocks are split at breakpoints so they're only checked on block
+        boundaries, and the instruction at the starting PC always executes.
+        conditions may map some of the breakpoints to a condition(registers, pc),
+        the run only stops there if it returns True for the list of x0..x31.
+        An exception raised by a condition stops the run before the breakpoint
+        and is raised again once the state is written back.
+        If watch is given it's called as watch(kind, address) on every load
+        ('r') and store ('w'), returning True stops the run after that access.
+        If undo is given, the first store to every word records the 4 bytes
+        it overwrites as undo[address], a copy-on-write log to roll memory back.
+        Words already in the log keep their oldest value.
+
+        Returns False if the CPU halted, like cycle().
+        """
+        if breakpoints != self._block_breakpoints:
+            self._clear_blocks()
+            self._block_breakpoints = frozenset(breakpoints)
+        regs: list = [int(self._registers.get_reg(i)) for i in range(32)]
+        pc: int = int(self.pc)
+        remaining: int = sys.maxsize if max_cycles is None else max_cycles
+        blocks: dict = self._blocks
+        read_word = self._data_mem.read_word
+        write_word = self._data_mem.write_word
+        extract = self._data_mem.extract
+        traps: list = self._traps
+        running: bool = True
+        block: tuple = ()
+        start: int = pc
+        retired: int = 0
+        # Counted locally and published to the performance counters in batches
+        add_counters = self.counters.add
+        published: int = 0
+        publish_at: int = _COUNTERS_INTERVAL
+        loads: int = 0
+        stores: int = 0
+        branches: int = 0
+        taken: int = 0
+        condition_error: Exception | None = None
+        try:
+            while remaining > 0:
+                start = pc
+                block = blocks.get(pc) # type: ignore
+                if block is None:
+                    block = blocks[pc] = self._build_block(pc)
+                if not block:
+                    running = False
+                    break
+                if len(block) > remaining:
+                    block = block[:remaining]
+                for op, rd, rs1, rs2, imm in block:
+                    pc += 4
+                    if op == _ADDI:
+                        regs[rd] = ((regs[rs1] + imm + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+                    elif op == _ADD:
+                        regs[rd] = ((regs[rs1] + regs[rs2] + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+                    elif op == _SUB:
+                        regs[rd] = ((regs[rs1] - regs[rs2] + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+                    elif op == _AND:
+                        regs[rd] = regs[rs1] & regs[rs2]
+                    elif op == _OR:
+                        regs[rd] = regs[rs1] | regs[rs2]
+                    elif op == _LW:
+                        address = regs[rs1] + imm
+                        regs[rd] = read_word(address)
+                        loads += 1
+                        if watch is not None and watch('r', address):
+                            break
+                    elif op == _SW:
+                        address = regs[rs1] + imm
+                        if undo is not None and address not in undo:
+                            undo[address] = extract(address, 4)
+                        write_word(address, regs[rs2])
+                        stores += 1
+                        if watch is not None and watch('w', address):
+                            break
+                    elif op == _BEQ:
+                        branches += 1
+                        if regs[rs1] == regs[rs2]:
+                            pc = imm
+                            taken += 1
+                    elif op == _BNE:
+                        branches += 1
+                        if regs[rs1] != regs[rs2]:
+                            pc = imm
+                            taken += 1
+                    else:
+                        raise ValueError(traps[imm])
+                else:
+                    retired += len(block)
+                    remaining -= len(block)
+                    if retired >= publish_at:
+                        add_counters(retired - published, loads, stores, branches, taken)
+                        published, publish_at = retired, retired + _COUNTERS_INTERVAL
+                        loads = stores = branches = taken = 0
+                    if pc in breakpoints:
+                        condition = conditions.get(pc) if conditions else None
+                        try:
+                            if condition is None or condition(regs, pc):
+                                break
+                        except Exception as e: # pylint: disable=broad-except
+                            # Not a fault of the program, the block is already retired
+                            condition_error = e
+                            break
+                    continue
+                # Stopped by a watchpoint, memory instructions never branch
+                retired += (pc - start) // 4
+                break
+        except Exception:
+            # Leave the PC on the faulting instruction
+            if pc != start:
+                retired += (pc - start) // 4 - 1
+                pc -= 4
+            raise
+        finally:
+            for i in range(1, 32):
+                self._registers.get_reg(i).write_int(regs[i])
+            self.pc = DataRegister(pc)
+            self._cycle_counter = self._cycle_counter + retired if running else 0
+            add_counters(retired - published, loads, stores, branches, taken)
+        if condition_error is not None:
+            raise condition_error
+        if not running:
+            logging.debug('[CPU] Fast engine halted at %s', hex(pc))
+        return running
@@ -0,0 +1,237 @@
+"""Tests for the data memory backends and their lifecycle"""
+
+import os
+import tempfile
+import unittest
+import uuid
+from array import array
+from single_cycle_cpu import RiscV
+from rv_units.data_memory import DataMemory
+from rv_units.register_file import DataRegister
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SIZE: int = 0x100
+
+
+class BackendTest(unittest.TestCase):
+    """Every backend stores the same data, the named ones keep it"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory() # pylint: disable=consider-using-with
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'data_memory.bin')
+
+    def _backends(self) -> list:
+        """Keyword arguments opening every backend"""
+        return [{'backend': 'memory'},
+                {'backend': 'file', 'path': self.path},
+                {'backend': 'mmap', 'path': None},
+                {'backend': 'mmap', 'path': self.path + '.mmap'},
+                {'backend': 'shm', 'path': f'rv-test-{uuid.uuid4().hex[:8]}'}]
+
+    def test_read_write(self):
+        for kwargs in self._backends():
+            with DataMemory(SIZE, **kwargs) as data_mem:
+                data_mem.write(0x10, DataRegister(-5))
+                self.assertEqual(int(data_mem.read(0x10)), -5)
+                self.assertEqual(int(data_mem.read(0x14)), 0)
+                self.assertEqual(len(data_mem), SIZE)
+                for address in (-4, SIZE - 2, SIZE):
+                    with self.assertRaises(ValueError):
+                        data_mem.read(address)
+
+    def test_files_persist(self):
+        for backend in ('file', 'mmap'):
+            with DataMemory(SIZE, backend, self.path) as data_mem:
+                data_mem.write(0x20, DataRegister(1234))
+            with DataMemory(SIZE, backend, self.path) as data_mem:
+                self.assertEqual(int(data_mem.read(0x20)), 1234)
+            os.remove(self.path)
+
+    def test_files_are_never_cut(self):
+        for backend in ('file', 'mmap'):
+            with open(self.path, 'wb') as f:
+                f.write(b'\x01' * 16)
+            with DataMemory(SIZE, backend, self.path) as data_mem:
+                self.assertEqual(data_mem.extract(0, 20), b'\x01' * 16 + bytes(4))
+            self.assertEqual(os.path.getsize(self.path), SIZE)
+            with self.assertRaises(ValueError):
+                DataMemory(SIZE // 2, backend, self.path)
+            with open(self.path, 'rb') as f:
+                self.assertEqual(f.read(), b'\x01' * 16 + bytes(SIZE - 16))
+            os.remove(self.path)
+
+    def test_shared_memory_is_shared(self):
+        name = f'rv-test-{uuid.uuid4().hex[:8]}'
+        with DataMemory(SIZE, 'shm', name) as owner:
+            with DataMemory(SIZE, 'shm', name) as attached:
+                attached.write(0x8, DataRegister(42))
+            self.assertEqual(int(owner.read(0x8)), 42)
+            with self.assertRaises(ValueError):
+                DataMemory(SIZE * 2, 'shm', name)
+        # The owner unlinks the block, a new memory with the name starts empty
+        with DataMemory(SIZE, 'shm', name) as data_mem:
+            self.assertEqual(int(data_mem.read(0x8)), 0)
+
+    def test_image(self):
+        image = array('i', [1, -2])
+        for kwargs in self._backends():
+            with DataMemory(SIZE, image=image, **kwargs) as data_mem:
+                self.assertEqual(int(data_mem.read(0)), 1)
+                self.assertEqual(int(data_mem.read(4)), -2)
+            for path in (self.path, self.path + '.mmap'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def test_image_checked_before_opening(self):
+        # 3 elements, but 12 bytes
+        image = array('i', [1, 2, 3])
+        for backend in ('file', 'mmap'):
+            with self.assertRaises(ValueError):
+                DataMemory(8, backend, self.path, image)
+            self.assertFalse(os.path.exists(self.path))
+
+    def test_invalid_arguments(self):
+        for args in ((0,), (SIZE, 'disk'), (SIZE, 'file')):
+            with self.assertRaises(ValueError):
+                DataMemory(*args)
+
+
+class AccessTest(unittest.TestCase):
+    """Bulk, block and typed access"""
+
+    def setUp(self):
+        self.data_mem = DataMemory(SIZE)
+        self.addCleanup(self.data_mem.close)
+
+    def test_typed_access(self):
+        data_mem = self.data_mem
+        data_mem.write_word(0, -2)
+        self.assertEqual(data_mem.read_word(0), -2)
+        self.assertEqual(data_mem.read_word(0, signed=False), 0xFFFFFFFE)
+        self.assertEqual(data_mem.read_half(2), -1)
+        self.assertEqual(data_mem.read_half(2, signed=False), 0xFFFF)
+        self.assertEqual(data_mem.read_byte(0, signed=False), 0xFE)
+        # Only the low bits are kept
+        data_mem.write_half(4, 0x12345678)
+        data_mem.write_byte(7, -1)
+        self.assertEqual(data_mem.extract(4, 4), b'\x78\x56\x00\xff')
+        self.assertEqual(data_mem.read_word(4, signed=False), 0xFF005678)
+
+    def test_alignment(self):
+        data_mem = self.data_mem
+        for read, write, address in ((data_mem.read_word, data_mem.write_word, 2),
+                                     (data_mem.read_word, data_mem.write_word, 1),
+                                     (data_mem.read_half, data_mem.write_half, 3)):
+            with self.assertRaises(ValueError):
+                read(address)
+            with self.assertRaises(ValueError):
+                write(address, 1)
+        data_mem.write_byte(3, 1)
+        for read in (data_mem.read_word, data_mem.read_half, data_mem.read_byte):
+            with self.assertRaises(ValueError):
+                read(SIZE)
+
+    def test_memset_memcpy(self):
+        data_mem = self.data_mem
+        data_mem.load(0, bytes(range(8)))
+        # Forward and backward overlaps
+        data_mem.memcpy(2, 0, 6)
+        self.assertEqual(data_mem.extract(0, 8), bytes((0, 1, 0, 1, 2, 3, 4, 5)))
+        data_mem.memcpy(0, 3, 5)
+        self.assertEqual(data_mem.extract(0, 8), bytes((1, 2, 3, 4, 5, 3, 4, 5)))
+        data_mem.memset(1, 0xAA, 3)
+        self.assertEqual(data_mem.extract(0, 5), bytes((1, 0xAA, 0xAA, 0xAA, 5)))
+        with self.assertRaises(ValueError):
+            data_mem.memset(0, 0x100, 1)
+        with self.assertRaises(ValueError):
+            data_mem.memcpy(SIZE - 2, 0, 4)
+
+    def test_load_extract(self):
+        data_mem = self.data_mem
+        data_mem.load(0, array('i', [1, -1]))
+        self.assertEqual(data_mem.extract(0, 8), b'\x01\x00\x00\x00\xff\xff\xff\xff')
+        # Strided sources are copied first
+        data_mem.load(8, memoryview(bytes(range(8)))[::2])
+        self.assertEqual(data_mem.extract(8, 4), bytes((0, 2, 4, 6)))
+        self.assertEqual(len(data_mem.extract(SIZE - 4)), 4)
+        with self.assertRaises(ValueError):
+            data_mem.load(SIZE - 4, array('i', [1, 2]))
+
+    def test_view(self):
+        for backend, path in (('memory', None), ('mmap', None),
+                              ('shm', f'rv-test-{uuid.uuid4().hex[:8]}')):
+            data_mem = DataMemory(SIZE, backend, path)
+            view = data_mem.view(4, 4)
+            view[0] = 7
+            self.assertEqual(data_mem.read_word(4), 7)
+            # The memory stays open while a view is alive, close can be retried
+            with self.assertRaises(BufferError):
+                data_mem.close()
+            self.assertFalse(data_mem.closed)
+            data_mem.write_word(8, 1)
+            self.assertEqual(data_mem.read_word(4), 7)
+            view.release()
+            data_mem.view() # Dropped right away
+            data_mem.close()
+            self.assertTrue(data_mem.closed)
+
+    def test_file_has_no_view(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with DataMemory(SIZE, 'file', os.path.join(directory, 'm.bin')) as data_mem:
+                with self.assertRaises(ValueError):
+                    data_mem.view()
+
+    @unittest.skipIf(np is None, 'numpy is not installed')
+    def test_as_array(self):
+        array_ = self.data_mem.as_array('<i4', 8, 2)
+        array_[1] = -3
+        self.assertEqual(self.data_mem.read_word(12), -3)
+        self.data_mem.write_word(8, 5)
+        self.assertEqual(array_.tolist(), [5, -3])
+        self.assertEqual(len(self.data_mem.as_array('<u2')), SIZE // 2)
+        with self.assertRaises(BufferError):
+            self.data_mem.close()
+        del array_
+        self.data_mem.close()
+
+        with tempfile.TemporaryDirectory() as directory:
+            with DataMemory(SIZE, 'file', os.path.join(directory, 'm.bin')) as data_mem:
+                data_mem.write_word(0, 9)
+                copy = data_mem.as_array()
+                self.assertEqual(copy[0], 9)
+                with self.assertRaises(ValueError):
+                    copy[0] = 1
+
+
+class LifecycleTest(unittest.TestCase):
+    """DataMemory and RiscV release the memory they own exactly once"""
+
+    def test_data_memory_close(self):
+        with DataMemory(SIZE) as data_mem:
+            self.assertFalse(data_mem.closed)
+        self.assertTrue(data_mem.closed)
+        data_mem.close()
+        with self.assertRaises(ValueError):
+            data_mem.read(0)
+
+    def test_risc_v_closes_its_own_memory(self):
+        with RiscV() as risc_v:
+            data_mem = risc_v.data_memory
+        self.assertTrue(data_mem.closed)
+        risc_v.close()
+
+    def test_risc_v_leaves_given_memory_open(self):
+        with DataMemory(SIZE) as data_mem:
+            with RiscV(data_mem) as risc_v:
+                self.assertIs(risc_v.data_memory, data_mem)
+            self.assertFalse(data_mem.closed)
+        self.assertTrue(data_mem.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+"""Tests for the debugger, checked against the cycle() trace of the test programs"""
+
+import contextlib
+import io
+import os
+import unittest
+from single_cycle_cpu import RiscV
+from debugger import Debugger, DebuggerShell, GdbStub, compile_condition
+from fuzzer import Instruction, encode
+
+HERE: str = os.path.dirname(os.path.abspath(__file__))
+PROGRAMS: tuple = ('teste1.txt', 'teste2.txt')
+
+
+def _state(risc_v: RiscV) -> tuple:
+    """PC, registers and the start of data memory"""
+    return (risc_v.pc_value(),
+            [int(risc_v.registers.get_reg(i)) for i in range(32)],
+            risc_v.data_memory.extract(0, 64))
+
+
+def _load(program: str) -> RiscV:
+    """Emulator with a test program loaded"""
+    risc_v = RiscV()
+    risc_v.load_program(os.path.join(HERE, program))
+    return risc_v
+
+
+def _store_program() -> RiscV:
+    """Emulator running addi x5, x0, -1 then sw x5, 0(x0)"""
+    risc_v = RiscV()
+    risc_v.load_instructions([encode(Instruction('addi', rd=5, imm=-1)),
+                              encode(Instruction('sw', rs2=5))])
+    return risc_v
+
+
+def _trace(program: str) -> list:
+    """State before every cycle of the data path, and after the last one"""
+    risc_v = _load(program)
+    states = [_state(risc_v)]
+    while risc_v.cycle():
+        states.append(_state(risc_v))
+    return states
+
+
+class DebuggerTest(unittest.TestCase):
+    """Stop rules and reverse execution of the headless debugger"""
+
+    def test_step_matches_cycle_trace(self):
+        for program in PROGRAMS:
+            trace = _trace(program)
+            risc_v = _load(program)
+            debugger = Debugger(risc_v)
+            for expected in trace[1:]:
+                self.assertEqual(debugger.step().reason, 'step')
+                self.assertEqual(_state(risc_v), expected)
+            self.assertEqual(debugger.step().reason, 'halted')
+
+    def test_reverse_step_replays_trace(self):
+        for program in PROGRAMS:
+            trace = _trace(program)
+            risc_v = _load(program)
+            debugger = Debugger(risc_v)
+            for _ in trace[1:]:
+                debugger.step()
+            for position in range(len(trace) - 2, -1, -1):
+                debugger.reverse_step()
+                self.assertEqual(debugger.position, position)
+                self.assertEqual(_state(risc_v), trace[position])
+            with self.assertRaises(ValueError):
+                debugger.reverse_step()
+
+    def test_reverse_step_after_continue(self):
+        for program in PROGRAMS:
+            trace = _trace(program)
+            risc_v = _load(program)
+            debugger = Debugger(risc_v)
+            self.assertEqual(debugger.cont().reason, 'halted')
+            debugger.reverse_step(3)
+            self.assertEqual(_state(risc_v), trace[-4])
+            debugger.cont()
+            self.assertEqual(_state(risc_v), trace[-1])
+
+    def test_reverse_step_after_write_memory(self):
+        zero = bytes(4)
+        # Write after the store, both logged for the same checkpoint
+        debugger = Debugger(risc_v := _store_program())
+        debugger.step(2)
+        debugger.write_memory(1, b'\x55')
+        debugger.reverse_step(2)
+        self.assertEqual(risc_v.data_memory.extract(0, 4), zero)
+
+        # Write before the store, both logged for the same checkpoint
+        debugger = Debugger(risc_v := _store_program())
+        debugger.step()
+        debugger.reverse_step()
+        debugger.write_memory(0, b'\x07')
+        self.assertEqual(debugger.cont().reason, 'halted')
+        self.assertEqual(risc_v.data_memory.extract(0, 4), b'\xff' * 4)
+        debugger.reverse_step(2)
+        self.assertEqual(risc_v.data_memory.extract(0, 4), zero)
+
+        # Write and store logged for different checkpoints
+        debugger = Debugger(risc_v := _store_program())
+        debugger.step()
+        debugger.write_memory(2, b'\x11')
+        debugger.step()
+        debugger.reverse_step()
+        self.assertEqual(risc_v.data_memory.extract(0, 4), b'\x00\x00\x11\x00')
+        debugger.reverse_step()
+        self.assertEqual(risc_v.data_memory.extract(0, 4), zero)
+
+    def test_breakpoints(self):
+        trace = _trace('teste2.txt')
+        hits = [i for i, state in enumerate(trace) if state[0] == 0x10]
+        risc_v = _load('teste2.txt')
+        debugger = Debugger(risc_v)
+        debugger.add_breakpoint(0x10)
+        for hit in hits:
+            self.assertEqual(debugger.cont().reason, 'breakpoint')
+            self.assertEqual(debugger.position, hit)
+            self.assertEqual(_state(risc_v), trace[hit])
+        debugger.remove_breakpoint(0x10)
+        self.assertEqual(debugger.cont().reason, 'halted')
+        self.assertEqual(_state(risc_v), trace[-1])
+
+    def test_conditional_breakpoints(self):
+        trace = _trace('teste2.txt')
+        hit = next(i for i, (pc, regs, _) in enumerate(trace) if pc == 0x10 and regs[17] == 2)
+        risc_v = _load('teste2.txt')
+        debugger = Debugger(risc_v)
+        debugger.add_breakpoint(0x10, compile_condition('x17 == 2'))
+        self.assertEqual(debugger.cont().reason, 'breakpoint')
+        self.assertEqual(debugger.position, hit)
+
+        risc_v = _load('teste2.txt')
+        debugger = Debugger(risc_v)
+        debugger.add_breakpoint(0x10, compile_condition('x17 < 0'))
+        self.assertEqual(debugger.cont().reason, 'halted')
+        self.assertEqual(_state(risc_v), trace[-1])
+
+    def test_failing_condition(self):
+        trace = _trace('teste1.txt')
+        risc_v = _load('teste1.txt')
+        debugger = Debugger(risc_v)
+        debugger.add_breakpoint(0x8, compile_condition('x5 // x0 == 1'))
+        with self.assertRaises(ZeroDivisionError):
+            debugger.cont()
+        self.assertEqual((debugger.position, risc_v.retired), (2, 2))
+        self.assertEqual(_state(risc_v), trace[2])
+        debugger.remove_breakpoint(0x8)
+        self.assertEqual(debugger.cont().reason, 'halted')
+        self.assertEqual(_state(risc_v), trace[-1])
+        self.assertEqual(risc_v.retired, len(trace) - 1)
+
+    def test_next_steps_over_loops(self):
+        for program, branch in (('teste2.txt', 0x18), ('teste3.txt', 0x14)):
+            trace = _trace(program)
+            risc_v = _load(program)
+            debugger = Debugger(risc_v)
+            debugger.add_breakpoint(branch)
+            debugger.cont()
+            debugger.remove_breakpoint(branch) # It would stop the next iteration
+            stop = debugger.next()
+            self.assertNotEqual(stop.pc, branch)
+            self.assertEqual(_state(risc_v), trace[debugger.position])
+            self.assertEqual(debugger.next().pc, stop.pc + 4) # Not a branch, plain step
+
+    def test_watchpoints(self):
+        trace = _trace('teste1.txt')
+        risc_v = _load('teste1.txt')
+        debugger = Debugger(risc_v)
+        debugger.add_watchpoint(0x18, 4, 'w')
+        stop = debugger.cont()
+        self.assertEqual((stop.reason, stop.address), ('watchpoint', 0x18))
+        self.assertEqual(_state(risc_v), trace[debugger.position])
+        debugger.remove_watchpoint(0x18)
+        debugger.add_watchpoint(0x14, 4, 'r')
+        stop = debugger.cont()
+        self.assertEqual((stop.reason, stop.detail), ('watchpoint', 'read of 0x14'))
+        self.assertEqual(debugger.cont().reason, 'halted')
+
+    def test_invalid_registers(self):
+        debugger = Debugger(_load('teste1.txt'))
+        for register in (0, 32, -1):
+            with self.assertRaises(ValueError):
+                debugger.set_register(register, 1)
+        for expression in ('x5 ==', 'x99 == 1', 'open("f")'):
+            with self.assertRaises(ValueError):
+                compile_condition(expression)
+
+
+class DebuggerShellTest(unittest.TestCase):
+    """Bad input is reported without leaving the shell"""
+
+    def test_bad_input(self):
+        shell = DebuggerShell(Debugger(_load('teste1.txt')))
+        for line in ('break 0x10 if x5 ==', 'break 0x10 if x99 == 1', 'mem', 'watch',
+                     'watch 0x10 4 x', 'set x40 1', 'set x5', 'delete 0x40', 'rstep'):
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                self.assertFalse(shell.onecmd(line))
+            self.assertIn('Error', output.getvalue(), line)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            shell.onecmd('continue')
+        self.assertIn('halted', output.getvalue())
+
+
+class GdbStubTest(unittest.TestCase):
+    """Packet handling of the GDB stub"""
+
+    def setUp(self):
+        self.stub = GdbStub(Debugger(_load('teste1.txt')))
+
+    def test_registers(self):
+        self.assertEqual(self.stub._handle('P5=07000000'), 'OK') # pylint: disable=protected-access
+        self.assertEqual(self.stub._handle('p5'), '07000000') # pylint: disable=protected-access
+        self.assertEqual(len(self.stub._handle('g')), 33 * 8) # pylint: disable=protected-access
+        for packet in ('P28=05000000', 'p21', 'G0000', 'Pzz=00', 'm1000000,4', 'Z0,2,4'):
+            self.assertEqual(self.stub._handle(packet), 'E01', packet) # pylint: disable=protected-access
+
+    def test_watchpoint_stops(self):
+        handle = self.stub._handle # pylint: disable=protected-access
+        self.assertEqual(handle('Z2,18,4'), 'OK')
+        self.assertEqual(handle('c'), 'T05watch:18;')
+        self.assertEqual(handle('z2,18,4'), 'OK')
+        self.assertEqual(handle('Z3,14,4'), 'OK')
+        self.assertEqual(handle('c'), 'T05rwatch:14;')
+        self.assertEqual(handle('Z4,18,4'), 'OK')
+        self.assertEqual(handle('c'), 'T05awatch:18;')
+        self.assertEqual(handle('c'), 'W00')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+"""Tests for the performance counters and the metrics endpoint"""
+
+import os
+import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+from single_cycle_cpu import RiscV, _COUNTERS_INTERVAL
+from fuzzer import Instruction, encode
+from metrics import MetricsSampler, MetricsServer
+from rv_units.performance_counters import PerformanceCounters
+
+HERE: str = os.path.dirname(os.path.abspath(__file__))
+PROGRAMS: tuple = ('teste1.txt', 'teste2.txt', 'teste3.txt')
+ITERATIONS: int = 2000 # Of the store loop, fits an addi and outlasts a batch of counters
+
+
+def _load(program: str) -> RiscV:
+    """Emulator with a test program loaded"""
+    risc_v = RiscV()
+    risc_v.load_program(os.path.join(HERE, program))
+    return risc_v
+
+
+def _store_loop() -> RiscV:
+    """Emulator running a loop storing a word on every iteration"""
+    risc_v = RiscV()
+    risc_v.load_instructions(encode(ins) for ins in (
+        Instruction('addi', rd=1, imm=ITERATIONS),
+        Instruction('sw', rs1=0, rs2=1),
+        Instruction('addi', rd=1, rs1=1, imm=-1),
+        Instruction('bne', rs1=1, rs2=0, imm=-8)))
+    return risc_v
+
+
+class PerformanceCountersTest(unittest.TestCase):
+    """Both engines publish the same counters"""
+
+    def test_engines_agree(self):
+        for program in PROGRAMS:
+            risc_v = _load(program)
+            while risc_v.cycle():
+                pass
+            expected = risc_v.counters.snapshot()
+            risc_v = _load(program)
+            self.assertFalse(risc_v.run())
+            self.assertEqual(risc_v.counters.snapshot(), expected, program)
+
+    def test_values(self):
+        risc_v = _load('teste1.txt')
+        risc_v.run()
+        self.assertEqual(risc_v.counters.snapshot(), {
+            'cycles': 12, 'retired': 12, 'loads': 2, 'stores': 2,
+            'bytes_read': 8, 'bytes_written': 8, 'branches': 0, 'branches_taken': 0})
+        self.assertEqual(risc_v.retired, 12)
+
+        risc_v = _store_loop()
+        risc_v.run()
+        values = risc_v.counters.snapshot()
+        self.assertEqual(values['retired'], 1 + 3 * ITERATIONS)
+        self.assertEqual(values['stores'], ITERATIONS)
+        self.assertEqual((values['branches'], values['branches_taken']),
+                         (ITERATIONS, ITERATIONS - 1))
+
+    def test_published_while_running(self):
+        risc_v = _store_loop()
+        lags: list = []
+
+        def watch(_kind, _address):
+            # Instructions executed before this store, minus the ones already published
+            lags.append(1 + 3 * len(lags) - risc_v.retired)
+            return False
+
+        risc_v.run(watch=watch)
+        self.assertEqual(len(lags), ITERATIONS)
+        self.assertGreater(max(lags), 0) # Published in batches
+        self.assertTrue(all(0 <= lag <= _COUNTERS_INTERVAL + 3 for lag in lags))
+        self.assertEqual(risc_v.retired, 1 + 3 * ITERATIONS)
+
+
+class MetricsSamplerTest(unittest.TestCase):
+    """Sliding window rate and stall time"""
+
+    def setUp(self):
+        self.counters = PerformanceCounters()
+        patcher = mock.patch('metrics.time.monotonic', return_value=0.0)
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sampler = MetricsSampler(self.counters, window=10.0)
+
+    def _sample_at(self, now: float, retired: int = 0) -> None:
+        """Retire instructions and take a sample at a given time"""
+        self.counters.add(retired)
+        self.clock.return_value = now
+        self.sampler.sample()
+
+    def test_ips(self):
+        self.assertEqual(self.sampler.snapshot()['ips'], 0.0)
+        self._sample_at(0.0)
+        self._sample_at(1.0, 100)
+        self._sample_at(2.0, 100)
+        self.assertEqual(self.sampler.snapshot()['ips'], 100.0)
+        # Samples older than the window are dropped
+        self._sample_at(20.0, 50)
+        self.assertEqual(self.sampler.snapshot()['ips'], 50 / 18)
+        self._sample_at(21.0, 60)
+        self.assertEqual(self.sampler.snapshot()['ips'], 60.0)
+
+    def test_stalled_seconds(self):
+        self._sample_at(0.0)
+        self._sample_at(3.0, 10)
+        self._sample_at(4.0)
+        self._sample_at(7.5)
+        snapshot = self.sampler.snapshot()
+        self.assertEqual(snapshot['stalled_seconds'], 4.5)
+        self.assertEqual(snapshot['retired'], 10)
+
+    def test_prometheus(self):
+        self.counters.add(7, loads=1)
+        self.sampler.labels = {'guest': 'a"b\\c\nd', 'run': 1}
+        text = self.sampler.prometheus()
+        self.assertIn('# TYPE rv_instructions_retired_total counter\n', text)
+        self.assertIn('rv_instructions_retired_total{guest="a\\"b\\\\c\\nd",run="1"} 7\n', text)
+        self.assertIn('rv_memory_read_bytes_total{guest="a\\"b\\\\c\\nd",run="1"} 4\n', text)
+        self.sampler.labels = {}
+        self.assertIn('\nrv_cycles_total 7\n', self.sampler.prometheus())
+
+
+class MetricsServerTest(unittest.TestCase):
+    """The endpoint serves the sampler of a running emulator"""
+
+    def test_endpoint(self):
+        with RiscV() as risc_v, MetricsSampler(risc_v.counters, interval=0.01) as sampler, \
+                MetricsServer(sampler, port=0) as server:
+            risc_v.load_program(os.path.join(HERE, 'teste1.txt'))
+            risc_v.run()
+            url = f'http://127.0.0.1:{server.port}'
+            with urllib.request.urlopen(f'{url}/metrics', timeout=5) as response:
+                self.assertEqual(response.status, 200)
+                self.assertTrue(response.headers['Content-Type'].startswith('text/plain'))
+                body = response.read().decode()
+            self.assertIn('rv_instructions_retired_total 12\n', body)
+            self.assertIn('rv_instructions_per_second ', body)
+            with self.assertRaises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(f'{url}/other', timeout=5) # pylint: disable=consider-using-with
+            self.assertEqual(error.exception.code, 404)
+            error.exception.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
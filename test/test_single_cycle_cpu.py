@@ -0,0 +1,52 @@
+"""Tests for the fast engine traps, checked against the data path"""
+
+import unittest
+from single_cycle_cpu import RiscV
+from fuzzer import Instruction, encode
+
+INVALID: tuple = ('0000000000000000000000000xx10011', # Malformed opcode
+                  '00000000000000000000000001111111', # Unknown opcode
+                  '0000000000000000000000000', # Truncated
+                  '00000000000000000000000000110011') # Writes x0
+
+
+def _load(instruction: str) -> RiscV:
+    """Emulator running addi x5, x0, 7 then instruction"""
+    risc_v = RiscV()
+    risc_v.load_instructions([encode(Instruction('addi', rd=5, imm=7)), instruction])
+    return risc_v
+
+
+class TrapTest(unittest.TestCase):
+    """Invalid instructions fault when they execute, in both engines"""
+
+    def test_decode(self):
+        risc_v = RiscV()
+        for instruction in INVALID:
+            decoded = risc_v.decode(instruction)
+            self.assertTrue(all(isinstance(field, int) for field in decoded), instruction)
+
+    def test_fault_state(self):
+        for instruction in INVALID:
+            expected = _load(instruction)
+            with self.assertRaises(ValueError):
+                while expected.cycle():
+                    pass
+            risc_v = _load(instruction)
+            with self.assertRaises(ValueError) as error:
+                risc_v.run()
+            self.assertIsInstance(error.exception.args[0], str)
+            self.assertEqual((risc_v.pc_value(), risc_v.retired), (4, 1), instruction)
+            self.assertEqual((expected.pc_value(), expected.retired), (4, 1), instruction)
+            self.assertEqual(int(risc_v.registers.get_reg(5)), 7)
+
+    def test_trap_not_reached(self):
+        risc_v = RiscV()
+        risc_v.load_instructions([encode(Instruction('beq', imm=8)), INVALID[0],
+                                  encode(Instruction('addi', rd=5, imm=7))])
+        self.assertFalse(risc_v.run())
+        self.assertEqual(int(risc_v.registers.get_reg(5)), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()